@@ -4,17 +4,21 @@ Then open http://127.0.0.1:5000/
 """
 
 import os
+import threading
 import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
 from io import BytesIO
 
-from flask import Flask, render_template, request, send_file, url_for
+from flask import Flask, Response, render_template, request, send_file, url_for
 from openpyxl import load_workbook
 
 from study_groups import (
-    build_csv,
+    DEFAULT_NUM_WORKERS,
     build_txt,
     get_next_study_group_sheet_name,
     get_prior_together_pairs,
+    iter_csv,
     load_students_from_excel,
     solve,
 )
@@ -22,8 +26,34 @@ from study_groups import (
 app = Flask(__name__)
 app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024  # 16 MB max upload
 
-# In-memory cache: token -> {"csv": str, "file": bytes, "groups": list of list of student dicts}
-_download_cache: dict[str, dict] = {}
+# In-memory cache: token -> {"timestamp": str, "file": bytes, "groups": list of list of student dicts}
+# After the first "Use groups" the built workbook replaces "file" as "xlsx": bytes.
+# Each entry carries its own "lock" so that one-off build never blocks other tokens.
+# Bounded LRU: once full, the least recently used token is evicted.
+DOWNLOAD_CACHE_MAX_ENTRIES = 32
+_download_cache: "OrderedDict[str, dict]" = OrderedDict()
+_download_cache_lock = threading.Lock()
+
+
+def _cache_put(token: str, entry: dict) -> None:
+    with _download_cache_lock:
+        _download_cache[token] = entry
+        while len(_download_cache) > DOWNLOAD_CACHE_MAX_ENTRIES:
+            _download_cache.popitem(last=False)
+
+
+def _cache_get(token: str):
+    """Return the entry for token (marking it recently used), or None if unknown or evicted."""
+    with _download_cache_lock:
+        entry = _download_cache.get(token)
+        if entry is not None:
+            _download_cache.move_to_end(token)
+        return entry
+
+
+@app.context_processor
+def _template_limits():
+    return {"max_workers": DEFAULT_NUM_WORKERS}
 
 
 @app.route("/")
@@ -48,9 +78,25 @@ def run():
 
     same_sex = request.form.get("group_type") == "same_sex"
 
+    # Optional: fewer solver workers avoid the parallel warm-up cost on small uploads.
+    # Capped so a client cannot make the server start more threads than the default.
+    try:
+        num_workers = min(max(int(request.form.get("num_workers", "")), 1), DEFAULT_NUM_WORKERS)
+    except ValueError:
+        num_workers = None
+
     try:
         data = f.read()
-        students = load_students_from_excel(BytesIO(data))
+        # Parse once; the roster and the prior study_group_N sheets both read from this wb.
+        wb = load_workbook(BytesIO(data), read_only=True, data_only=True)
+        try:
+            students = load_students_from_excel(wb=wb)
+            try:
+                prior_pairs = get_prior_together_pairs(students, wb=wb)
+            except Exception:
+                prior_pairs = set()
+        finally:
+            wb.close()
     except Exception as e:
         return render_template("index.html", error=f"Could not read Excel file: {e}"), 400
 
@@ -58,27 +104,26 @@ def run():
         return render_template("index.html", error="No valid students (B=sex, C=firstname, D=lastname) found in the file."), 400
 
     try:
-        prior_pairs = get_prior_together_pairs(BytesIO(data))
-    except Exception:
-        prior_pairs = set()
-
-    try:
-        groups = solve(group_size, same_sex, students, prior_together_pairs=prior_pairs)
+        groups = solve(
+            group_size, same_sex, students, prior_together_pairs=prior_pairs, num_workers=num_workers
+        )
     except RuntimeError as e:
         return render_template("index.html", error=str(e)), 400
 
     groups_txt = build_txt(groups)
-    csv_content = build_csv(groups)
+    # The CSV is streamed from groups on download; only its timestamp is fixed here.
+    csv_timestamp = datetime.now(timezone.utc).isoformat()
     token = uuid.uuid4().hex
     original_filename = os.path.basename(f.filename or "study_groups_updated.xlsx")
     if not original_filename.lower().endswith(".xlsx"):
         original_filename = original_filename + ".xlsx" if "." not in original_filename else "study_groups_updated.xlsx"
-    _download_cache[token] = {
-        "csv": csv_content,
+    _cache_put(token, {
+        "timestamp": csv_timestamp,
         "file": data,
         "groups": groups,
         "filename": original_filename,
-    }
+        "lock": threading.Lock(),
+    })
 
     return render_template(
         "result.html",
@@ -92,14 +137,14 @@ def run():
 
 @app.route("/download/<token>.csv")
 def download_csv(token):
-    if token not in _download_cache:
+    entry = _cache_get(token)
+    if entry is None:
         return "Download expired or invalid.", 404
-    csv_content = _download_cache[token]["csv"]
-    return send_file(
-        BytesIO(csv_content.encode("utf-8")),
+    lines = iter_csv(entry["groups"], timestamp=entry["timestamp"])
+    return Response(
+        (line.encode("utf-8") for line in lines),
         mimetype="text/csv; charset=utf-8",
-        as_attachment=True,
-        download_name="study_groups.csv",
+        headers={"Content-Disposition": "attachment; filename=study_groups.csv"},
     )
 
 
@@ -108,10 +153,10 @@ def _build_xlsx_with_groups_worksheet(file_bytes: bytes, groups: list) -> BytesI
     wb = load_workbook(BytesIO(file_bytes), read_only=False)
     sheet_name = get_next_study_group_sheet_name(wb=wb)
     ws = wb.create_sheet(sheet_name)  # append at end so the first sheet stays the original
-    ws.append(["Group", "Sex", "Name"])
+    ws.append(("Group", "Sex", "Name"))
     for i, group in enumerate(groups, start=1):
         for s in group:
-            ws.append([i, s["sex"], s["name"]])
+            ws.append((i, s["sex"], s["name"]))
     out = BytesIO()
     wb.save(out)
     out.seek(0)
@@ -121,13 +166,19 @@ def _build_xlsx_with_groups_worksheet(file_bytes: bytes, groups: list) -> BytesI
 @app.route("/use_groups", methods=["POST"])
 def use_groups():
     token = request.form.get("token")
-    if not token or token not in _download_cache:
+    entry = _cache_get(token) if token else None
+    if entry is None:
         return "Invalid or expired. Run the optimisation again.", 404
-    entry = _download_cache[token]
-    xlsx_io = _build_xlsx_with_groups_worksheet(entry["file"], entry["groups"])
+    # Build once per token; repeat clicks reuse the saved bytes instead of re-parsing the upload.
+    with entry["lock"]:
+        xlsx_bytes = entry.get("xlsx")
+        if xlsx_bytes is None:
+            xlsx_bytes = _build_xlsx_with_groups_worksheet(entry["file"], entry["groups"]).getvalue()
+            entry["xlsx"] = xlsx_bytes
+            entry.pop("file", None)
     download_name = entry.get("filename", "study_groups_updated.xlsx")
     return send_file(
-        xlsx_io,
+        BytesIO(xlsx_bytes),
         mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         as_attachment=True,
         download_name=download_name,
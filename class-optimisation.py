@@ -6,7 +6,6 @@ from typing import Union
 
 import class_config as cfg
 
-model = cp_model.CpModel()
 
 def _normalize_sex(value: str) -> str:
     v = (value or "").strip().lower()
@@ -60,145 +59,161 @@ def load_students_from_csv(csv_path: Union[str, Path]):
     return students_local
 
 
-students = load_students_from_csv(cfg.CSV_PATH)
-classes = cfg.CLASSES
+def build_model(students, classes, cfg):
+    """
+    Build the class-assignment CP-SAT model from the student list and config.
+    Returns (model, assignments, class_size_expr); assignments maps (student id, class) to a BoolVar
+    and class_size_expr maps each class to the LinearExpr counting its students.
+    """
+    model = cp_model.CpModel()
+
+    # Bucket students by attribute in one pass so the per-class loops below only
+    # touch the students they count.
+    by_sex = {"F": [], "M": []}
+    by_origin = {}
+    by_subject = {}
+    by_language = {}
+    for s in students:
+        if s["sex"] in by_sex:
+            by_sex[s["sex"]].append(s)
+        by_origin.setdefault(s["origin"], []).append(s)
+        by_subject.setdefault(s["subject"], []).append(s)
+        by_language.setdefault(s["language"], []).append(s)
+
+    assignments = {}
+    for s in students:
+        for c in classes:
+            assignments[(s["id"], c)] = model.NewBoolVar(f's{s["id"]}_in_{c}')
+
+    # Each student must be assigned to exactly one class
+    for s in students:
+        model.AddExactlyOne([assignments[(s["id"], c)] for c in classes])
 
-assignments = {}
-for s in students:
+    min_female = cfg.MIN_FEMALE_PER_CLASS
+    max_female = len(students) - 2
+    min_male = cfg.MIN_MALE_PER_CLASS
+    max_male = len(students) - 2
     for c in classes:
-        assignments[(s["id"], c)] = model.NewBoolVar(f's{s["id"]}_in_{c}')
-
-# Each student must be assigned to exactly one class
-for s in students:
-    model.Add(sum(assignments[(s["id"], c)] for c in classes) == 1)
-
-min_female = cfg.MIN_FEMALE_PER_CLASS
-max_female = len(students) - 2
-min_male = cfg.MIN_MALE_PER_CLASS
-max_male = len(students) - 2
-for c in classes:
-    # Sum only variables where the student's sex is 'F'
-    female_count = sum(
-        assignments[(s["id"], c)] 
-        for s in students if s["sex"] == "F"
-    )
-    male_count = sum(
-        assignments[(s["id"], c)] 
-        for s in students if s["sex"] == "M"
-    )
-    model.Add(female_count >= min_female)
-    model.Add(female_count <= max_female)
-    model.Add(male_count >= min_male)
-    model.Add(male_count <= max_male)
-# Hard constraint: class capacity
-MAX_CLASS_SIZE = cfg.MAX_CLASS_SIZE
-MIN_CLASS_SIZE = cfg.MIN_CLASS_SIZE
-class_sizes = {}
-for c in classes:
-    class_size = model.NewIntVar(0, len(students), f"class_size_{c}")
-    model.Add(class_size == sum(assignments[(s["id"], c)] for s in students))
-    class_sizes[c] = class_size
-    model.Add(class_size <= MAX_CLASS_SIZE)
-    model.Add(class_size >= MIN_CLASS_SIZE)
-
-penalties = []
-
-# Soft rule: balance class sizes around the average.
-# Penalize absolute deviation from the closest integer target (floor/ceil of N/K).
-CLASS_BALANCE_WEIGHT = cfg.CLASS_BALANCE_WEIGHT
-target_floor = len(students) // len(classes)
-target_ceil = (len(students) + len(classes) - 1) // len(classes)
-for c in classes:
-    dev_floor = model.NewIntVar(0, len(students), f"dev_floor_{c}")
-    dev_ceil = model.NewIntVar(0, len(students), f"dev_ceil_{c}")
-    model.AddAbsEquality(dev_floor, class_sizes[c] - target_floor)
-    model.AddAbsEquality(dev_ceil, class_sizes[c] - target_ceil)
-    dev = model.NewIntVar(0, len(students), f"size_dev_{c}")
-    model.AddMinEquality(dev, [dev_floor, dev_ceil])
-    penalties.append(dev * CLASS_BALANCE_WEIGHT)
-
-ORIGIN_WEIGHT = cfg.ORIGIN_WEIGHT
-origins = sorted({s["origin"] for s in students if (s.get("origin") or "").strip()})
-for c in classes:
-    for origin in origins:
-        # Count students from this origin in this class
-        origin_count = sum(
-            assignments[(s["id"], c)] 
-            for s in students if s["origin"] == origin
-        )
-        
-        # Create a 'excess' variable: how many students over the per-origin limit?
-        excess = model.NewIntVar(0, len(students), f'excess_{origin}_{c}')
-        
-        # excess >= (origin_count - ORIGIN_MAX_PER_CLASS)
-        model.Add(excess >= origin_count - cfg.ORIGIN_MAX_PER_CLASS)
-        
-        # We want to minimize this excess
-        penalties.append(excess * ORIGIN_WEIGHT)  # weight/cost of this penalty
-
-# Soft rule: prefer students with the same subject to be in the same class.
-# Penalty = weight * (number of classes that have this subject - 1), so 0 when all are together.
-SUBJECT_WEIGHT = cfg.SUBJECT_WEIGHT
-subjects = list({s["subject"] for s in students})
-for subject in subjects:
-    # For each class, indicate whether it has any student from this subject
-    has_in_class = []
+        female_vars = [assignments[(s["id"], c)] for s in by_sex["F"]]
+        male_vars = [assignments[(s["id"], c)] for s in by_sex["M"]]
+        female_count = cp_model.LinearExpr.Sum(female_vars)
+        male_count = cp_model.LinearExpr.Sum(male_vars)
+        model.Add(female_count >= min_female)
+        model.Add(female_count <= max_female)
+        model.Add(male_count >= min_male)
+        model.Add(male_count <= max_male)
+    # Hard constraint: class capacity
+    MAX_CLASS_SIZE = cfg.MAX_CLASS_SIZE
+    MIN_CLASS_SIZE = cfg.MIN_CLASS_SIZE
+    # Class sizes stay plain linear expressions; an IntVar per class would only add a linking constraint.
+    class_size_expr = {}
     for c in classes:
-        subject_count = sum(
-            assignments[(s["id"], c)] for s in students if s["subject"] == subject
-        )
-        has = model.NewBoolVar(f"has_{subject}_{c}")
-        model.Add(subject_count >= 1).OnlyEnforceIf(has)
-        model.Add(subject_count == 0).OnlyEnforceIf(has.Not())
-        has_in_class.append(has)
-    # Spread = (number of classes with this subject) - 1; 0 when all in one class
-    num_classes_with = model.NewIntVar(0, len(classes), f"nclass_{subject}")
-    model.Add(num_classes_with == sum(has_in_class))
-    spread = model.NewIntVar(0, len(classes) - 1, f"spread_{subject}")
-    model.Add(spread == num_classes_with - 1)
-    penalties.append(spread * SUBJECT_WEIGHT)
-
-# Soft rule: prefer students with the same language to be in the same class.
-# Penalty = weight * (number of classes that have this language - 1), so 0 when all are together.
-LANGUAGE_WEIGHT = cfg.LANGUAGE_WEIGHT
-languages = list({s["language"] for s in students if (s.get("language") or "").strip()})
-for language in languages:
-    has_in_class = []
+        class_size_expr[c] = cp_model.LinearExpr.Sum([assignments[(s["id"], c)] for s in students])
+        model.Add(class_size_expr[c] <= MAX_CLASS_SIZE)
+        model.Add(class_size_expr[c] >= MIN_CLASS_SIZE)
+
+    # Symmetry breaking: all classes share the same rules, so list them largest first.
+    for c_prev, c_next in zip(classes, classes[1:]):
+        model.Add(class_size_expr[c_prev] >= class_size_expr[c_next])
+
+    penalties = []
+
+    # Soft rule: balance class sizes around the average.
+    # Penalize absolute deviation from the closest integer target (floor/ceil of N/K).
+    CLASS_BALANCE_WEIGHT = cfg.CLASS_BALANCE_WEIGHT
+    target_floor = len(students) // len(classes)
+    target_ceil = (len(students) + len(classes) - 1) // len(classes)
+    for c in classes:
+        dev_floor = model.NewIntVar(0, len(students), f"dev_floor_{c}")
+        dev_ceil = model.NewIntVar(0, len(students), f"dev_ceil_{c}")
+        model.AddAbsEquality(dev_floor, class_size_expr[c] - target_floor)
+        model.AddAbsEquality(dev_ceil, class_size_expr[c] - target_ceil)
+        dev = model.NewIntVar(0, len(students), f"size_dev_{c}")
+        model.AddMinEquality(dev, [dev_floor, dev_ceil])
+        penalties.append(dev * CLASS_BALANCE_WEIGHT)
+
+    ORIGIN_WEIGHT = cfg.ORIGIN_WEIGHT
+    origins = sorted(o for o in by_origin if o)
     for c in classes:
-        language_count = sum(
-            assignments[(s["id"], c)] for s in students if s["language"] == language
-        )
-        has = model.NewBoolVar(f"has_lang_{language}_{c}")
-        model.Add(language_count >= 1).OnlyEnforceIf(has)
-        model.Add(language_count == 0).OnlyEnforceIf(has.Not())
-        has_in_class.append(has)
-    num_classes_with = model.NewIntVar(0, len(classes), f"nclass_lang_{language}")
-    model.Add(num_classes_with == sum(has_in_class))
-    spread = model.NewIntVar(0, len(classes) - 1, f"spread_lang_{language}")
-    model.Add(spread == num_classes_with - 1)
-    penalties.append(spread * LANGUAGE_WEIGHT)
-
-model.Minimize(sum(penalties))
-
-solver = cp_model.CpSolver()
-# Optional: Set a time limit so it doesn't run forever on huge datasets
-solver.parameters.max_time_in_seconds = 30.0 
-
-status = solver.Solve(model)
-
-if status == cp_model.OPTIMAL or status == cp_model.FEASIBLE:
+        for origin in origins:
+            # Count students from this origin in this class
+            origin_count = cp_model.LinearExpr.Sum(
+                [assignments[(s["id"], c)] for s in by_origin[origin]]
+            )
+
+            # Create a 'excess' variable: how many students over the per-origin limit?
+            excess = model.NewIntVar(0, len(students), f'excess_{origin}_{c}')
+
+            # excess >= (origin_count - ORIGIN_MAX_PER_CLASS)
+            model.Add(excess >= origin_count - cfg.ORIGIN_MAX_PER_CLASS)
+
+            # We want to minimize this excess
+            penalties.append(excess * ORIGIN_WEIGHT)  # weight/cost of this penalty
+
+    # Soft rule: prefer students with the same subject to be in the same class.
+    # Penalty = weight * (number of classes that have this subject - 1), so 0 when all are together.
+    SUBJECT_WEIGHT = cfg.SUBJECT_WEIGHT
+    subjects = list(by_subject)
+    for subject in subjects:
+        # For each class, indicate whether it has any student from this subject
+        has_in_class = []
+        for c in classes:
+            # has >= each assignment, as plain clauses; minimising spread keeps has at 0 otherwise
+            has = model.NewBoolVar(f"has_{subject}_{c}")
+            for s in by_subject[subject]:
+                model.AddImplication(assignments[(s["id"], c)], has)
+            has_in_class.append(has)
+        # Spread = (number of classes with this subject) - 1; 0 when all in one class
+        spread = model.NewIntVar(0, len(classes) - 1, f"spread_{subject}")
+        model.Add(spread == cp_model.LinearExpr.Sum(has_in_class) - 1)
+        penalties.append(spread * SUBJECT_WEIGHT)
+
+    # Soft rule: prefer students with the same language to be in the same class.
+    # Penalty = weight * (number of classes that have this language - 1), so 0 when all are together.
+    LANGUAGE_WEIGHT = cfg.LANGUAGE_WEIGHT
+    languages = [language for language in by_language if language]
+    for language in languages:
+        has_in_class = []
+        for c in classes:
+            # has >= each assignment, as plain clauses; minimising spread keeps has at 0 otherwise
+            has = model.NewBoolVar(f"has_lang_{language}_{c}")
+            for s in by_language[language]:
+                model.AddImplication(assignments[(s["id"], c)], has)
+            has_in_class.append(has)
+        spread = model.NewIntVar(0, len(classes) - 1, f"spread_lang_{language}")
+        model.Add(spread == cp_model.LinearExpr.Sum(has_in_class) - 1)
+        penalties.append(spread * LANGUAGE_WEIGHT)
+
+    model.Minimize(sum(penalties))
+    return model, assignments, class_size_expr
+
+
+def solve_and_report(model, assignments, students, classes, cfg):
+    """Solve the model, print the report and write the .txt and .csv results."""
+    solver = cp_model.CpSolver()
+    # Optional: Set a time limit so it doesn't run forever on huge datasets
+    solver.parameters.max_time_in_seconds = 30.0 
+    solver.parameters.num_workers = cfg.NUM_SEARCH_WORKERS
+
+    status = solver.Solve(model)
+
+    if status != cp_model.OPTIMAL and status != cp_model.FEASIBLE:
+        print("Could not find a solution that satisfies all hard constraints.")
+        return
+
     lines = []
     lines.append(f"Solution found (Status: {solver.StatusName(status)})")
     lines.append("")
-    
+
     # Organize results by class for better readability
     class_grouping = {c: [] for c in classes}
-    
+
     for s in students:
         for c in classes:
             # Check if the solver set this assignment to 1 (True)
-            if solver.Value(assignments[(s["id"], c)]) == 1:
+            if solver.BooleanValue(assignments[(s["id"], c)]):
                 class_grouping[c].append(s)
+                break
 
     # Build the report
     for c in classes:
@@ -212,7 +227,7 @@ if status == cp_model.OPTIMAL or status == cp_model.FEASIBLE:
             )
         lines.append(f"Total: {len(class_grouping[c])} students")
         lines.append("")
-        
+
     # Print the total 'penalty' score if you have soft rules
     lines.append(f"Total Penalty Score: {solver.ObjectiveValue()}")
 
@@ -239,5 +254,13 @@ if status == cp_model.OPTIMAL or status == cp_model.FEASIBLE:
                 ])
     print(f"Wrote CSV results to: {cfg.OUTPUT_CSV_PATH}")
 
-else:
-    print("Could not find a solution that satisfies all hard constraints.")
\ No newline at end of file
+
+def main():
+    students = load_students_from_csv(cfg.CSV_PATH)
+    classes = cfg.CLASSES
+    model, assignments, _ = build_model(students, classes, cfg)
+    solve_and_report(model, assignments, students, classes, cfg)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@ Central configuration for `class-optimisation.py`.
 Edit values here to tune the model without changing solver logic.
 """
 
+import os
 from pathlib import Path
 
 # Input
@@ -50,3 +51,6 @@ CLASS_BALANCE_WEIGHT = 2
 # Prefer at most this many students with the same origin in a class.
 ORIGIN_MAX_PER_CLASS = 2
 
+# Solver
+# Parallel CP-SAT search workers (portfolio search scales up to ~8), capped at the core count.
+NUM_SEARCH_WORKERS = min(8, os.cpu_count() or 1)
@@ -5,45 +5,27 @@ Created on Tue May 24 20:54:36 2022
 @author: krist
 """
 
-import os
-import json
-os.chdir(r'C:\Users\krist\Desktop\classplanning')
-with open('classes.txt','r', encoding=('utf8')) as d:
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent
+
+with open(BASE_DIR / 'classes.txt','r', encoding=('utf8')) as d:
     classes = list(line.lower().rstrip("\n") for line in d)
 #    print(classes)
 
-classroomset = set()
-with open('classrooms.txt','r', encoding=('utf8')) as d:
-    for line in d:
-        line = line.partition(",")
-        classroomset.add(line[0])
+with open(BASE_DIR / 'classrooms.txt','r', encoding=('utf8')) as d:
+    classroomset = dict.fromkeys(line.partition(",")[0] for line in d)
 #    print(classroomset)
-weeklyslots = set()
-with open('weeklyslots.txt','r', encoding=('utf8')) as d:
-    for line in d:
-        line = line.rstrip("\n")
-        weeklyslots.add(line)
+with open(BASE_DIR / 'weeklyslots.txt','r', encoding=('utf8')) as d:
+    weeklyslots = dict.fromkeys(line.rstrip("\n") for line in d)
 #    print(weeklyslots)
 #here the set of available classes are generated in availableclasses combining weeklyslots with the classrooms
-availableclasses = list()
-for line in weeklyslots:
-    for rooms in classroomset:
-        availclass = line+"-"+rooms
-        availableclasses.append(availclass)
+#file order is kept (duplicates dropped) so the assignment is the same on every run
+availableclasses = [line+"-"+rooms for line in weeklyslots for rooms in classroomset]
 
 #print(availableclasses)
-#This assignes classes to available slots and classrooms
-assignedclasses = dict()
-for nclass in classes:
-    i=1
-    while availableclasses[i]:
-        assignedclass = availableclasses[i-1]
-        print(assignedclass)
-        if assignedclasses.get(nclass):
-            else:
-                assignedclasses[assignedclass]= nclass
-                availableclasses.pop(i-1)
-        i+=1
-    
+#This assignes each class to the next available slot and classroom
+assignedclasses = dict(zip(availableclasses, classes))
+
 print(assignedclasses)
 #print(availableclasses)
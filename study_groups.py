@@ -4,11 +4,12 @@ No web imports; use from Flask app or tests.
 """
 
 import csv
+import os
 import re
 from datetime import datetime, timezone
-from io import BytesIO, StringIO
+from io import BytesIO
 from math import ceil
-from typing import Any, BinaryIO, List, Set, Tuple, Union
+from typing import Any, BinaryIO, Iterator, List, Set, Tuple, Union
 
 from ortools.sat.python import cp_model
 
@@ -22,65 +23,68 @@ COL_SEX = 2
 COL_FIRSTNAME = 3
 COL_LASTNAME = 4
 
+# CP-SAT portfolio workers; scaling flattens out beyond ~8.
+DEFAULT_NUM_WORKERS = min(8, os.cpu_count() or 1)
+
+
+_SEX_MAP = {
+    "k": "F", "f": "F", "female": "F", "kvinde": "F",
+    "m": "M", "male": "M", "mand": "M",
+}
+
 
 def _normalize_sex(value: str) -> str:
-    v = (value or "").strip().lower()
-    if v in {"k", "f", "female", "kvinde"}:
-        return "F"
-    if v in {"m", "male", "mand"}:
-        return "M"
-    return (value or "").strip().upper()
+    v = (value or "").strip()
+    return _SEX_MAP.get(v.lower(), v.upper())
 
 
 def load_students_from_excel(
-    filelike: Union[str, BinaryIO, BytesIO],
+    filelike: Union[str, BinaryIO, BytesIO, Any] = None,
+    wb: Any = None,
 ) -> List[dict]:
     """
     Load students from an Excel file. Columns: B=sex, C=firstname, D=lastname.
     Full name = firstname + " " + lastname (stripped). Only rows with sex F or M are included.
+    Pass either filelike (path or file) or an open workbook wb; a passed wb is left open.
     """
-    if load_workbook is None:
-        raise ImportError("openpyxl is required; install with: pip install openpyxl")
-
-    wb = load_workbook(read_only=True, data_only=True, filename=filelike)
-    ws = wb.active
-    students: List[dict] = []
-    for row_idx, row in enumerate(ws.iter_rows(min_row=1, max_row=ws.max_row, values_only=True), start=1):
-        if not row or len(row) < max(COL_SEX, COL_FIRSTNAME, COL_LASTNAME):
-            continue
-        # Skip header: assume first row might be header (no integer in col B or names in C/D)
-        sex_raw = row[COL_SEX - 1] if len(row) >= COL_SEX else None
-        first = row[COL_FIRSTNAME - 1] if len(row) >= COL_FIRSTNAME else None
-        last = row[COL_LASTNAME - 1] if len(row) >= COL_LASTNAME else None
-        sex_raw = (sex_raw or "").strip() if sex_raw is not None else ""
-        first = (first or "").strip() if first is not None else ""
-        last = (last or "").strip() if last is not None else ""
-        if not sex_raw and not first and not last:
-            continue
-        sex = _normalize_sex(sex_raw)
-        if sex not in ("F", "M"):
-            continue
-        parts = [p for p in [first, last] if p]
-        full_name = " ".join(parts) if parts else f"Student {row_idx}"
-        students.append({
-            "id": len(students),
-            "name": full_name,
-            "sex": sex,
-        })
-    wb.close()
+    own_wb = wb is None
+    if own_wb:
+        if load_workbook is None:
+            raise ImportError("openpyxl is required; install with: pip install openpyxl")
+        wb = load_workbook(read_only=True, data_only=True, filename=filelike)
+    try:
+        ws = wb.active
+        students: List[dict] = []
+        # Only columns B:D are read; the header row is dropped by the sex lookup.
+        rows = ws.iter_rows(min_row=1, min_col=COL_SEX, max_col=COL_LASTNAME, values_only=True)
+        for row_idx, (sex_raw, first, last) in enumerate(rows, start=1):
+            sex = _SEX_MAP.get((sex_raw or "").strip().lower())
+            if sex is None:
+                continue
+            first = (first or "").strip()
+            last = (last or "").strip()
+            full_name = f"{first} {last}".strip() or f"Student {row_idx}"
+            students.append({
+                "id": len(students),
+                "name": full_name,
+                "sex": sex,
+            })
+    finally:
+        if own_wb:
+            wb.close()
     return students
 
 
 # Worksheet naming: study_group_1, study_group_2, ...
 STUDY_GROUP_SHEET_PREFIX = "study_group_"
+_SG_SHEET_RE = re.compile(r"^study_group_(\d+)$", re.IGNORECASE)
 
 
 def _study_group_sheet_numbers(wb: Any) -> List[int]:
     """Return sorted list of N for which sheet 'study_group_N' exists."""
     numbers = []
-    pattern = re.compile(r"^study_group_(\d+)$", re.IGNORECASE)
     for name in wb.sheetnames:
-        m = pattern.match(name.strip())
+        m = _SG_SHEET_RE.match(name.strip())
         if m:
             numbers.append(int(m.group(1)))
     return sorted(set(numbers))
@@ -107,96 +111,163 @@ def get_next_study_group_sheet_name(
 
 
 def get_prior_together_pairs(
-    filelike: Union[str, BinaryIO, BytesIO],
-) -> Set[Tuple[str, str]]:
+    students: List[dict],
+    filelike: Union[str, BinaryIO, BytesIO, Any] = None,
+    wb: Any = None,
+) -> Set[Tuple[int, int]]:
     """
-    Read all study_group_1, study_group_2, ... sheets and return pairs of names
-    that have been in the same group before. Each pair is (name1, name2) with name1 < name2.
+    Read all study_group_1, study_group_2, ... sheets and return pairs of students
+    that have been in the same group before. Names are matched against students;
+    each pair is (id1, id2) of student ids with id1 < id2. Unknown names are skipped.
+    Pass either filelike (path or file) or an open workbook wb; a passed wb is left open.
     """
-    if load_workbook is None:
-        raise ImportError("openpyxl is required")
-    wb = load_workbook(read_only=True, data_only=True, filename=filelike)
-    pairs: Set[Tuple[str, str]] = set()
-    pattern = re.compile(r"^study_group_(\d+)$", re.IGNORECASE)
-    for sheet_name in wb.sheetnames:
-        if not pattern.match(sheet_name.strip()):
-            continue
-        ws = wb[sheet_name]
-        # Columns: Group, Sex, Name (row 1 = header)
-        by_group: dict = {}
-        for row in ws.iter_rows(min_row=2, max_row=ws.max_row, values_only=True):
-            if not row or len(row) < 3:
-                continue
-            group_num, name = row[0], (row[2] or "").strip()
-            if not name:
-                continue
-            try:
-                g = int(group_num)
-            except (TypeError, ValueError):
+    own_wb = wb is None
+    if own_wb:
+        if load_workbook is None:
+            raise ImportError("openpyxl is required")
+        wb = load_workbook(read_only=True, data_only=True, filename=filelike)
+    name_to_id = {s["name"].strip(): s["id"] for s in students}
+    # (sheet, group number) -> student ids, across all study_group_N sheets
+    by_group: dict = {}
+    try:
+        for sheet_name in wb.sheetnames:
+            if not _SG_SHEET_RE.match(sheet_name.strip()):
                 continue
-            by_group.setdefault(g, []).append(name)
-        for names in by_group.values():
-            for i, a in enumerate(names):
-                for b in names[i + 1 :]:
-                    pair = tuple(sorted([a, b]))
-                    pairs.add(pair)
-    wb.close()
+            ws = wb[sheet_name]
+            # Columns: Group, Sex, Name (row 1 = header); only A:C are read
+            for group_num, _, name in ws.iter_rows(min_row=2, max_col=3, values_only=True):
+                sid = name_to_id.get((name or "").strip())
+                if sid is None:
+                    continue
+                try:
+                    g = int(group_num)
+                except (TypeError, ValueError):
+                    continue
+                by_group.setdefault((sheet_name, g), []).append(sid)
+    finally:
+        if own_wb:
+            wb.close()
+    pairs: Set[Tuple[int, int]] = set()
+    for ids in by_group.values():
+        for i, a in enumerate(ids):
+            for b in ids[i + 1 :]:
+                if a != b:
+                    pairs.add((a, b) if a < b else (b, a))
     return pairs
 
 
 def load_students_from_study_groups_sheet(
-    filelike: Union[str, BinaryIO, BytesIO],
+    filelike: Union[str, BinaryIO, BytesIO, Any] = None,
+    wb: Any = None,
 ) -> List[dict]:
     """
     Load students from the latest study_group_N worksheet (Group, Sex, Name).
     Returns list of dicts with "id", "name", "sex", "group" (1-based group number).
     Use this to read a spreadsheet that was saved via "Use groups".
+    Pass either filelike (path or file) or an open workbook wb; a passed wb is left open.
     """
-    if load_workbook is None:
-        raise ImportError("openpyxl is required; install with: pip install openpyxl")
-    wb = load_workbook(read_only=True, data_only=True, filename=filelike)
-    numbers = _study_group_sheet_numbers(wb)
-    if not numbers:
-        wb.close()
-        return []
-    sheet_name = f"{STUDY_GROUP_SHEET_PREFIX}{numbers[-1]}"
-    ws = wb[sheet_name]
+    own_wb = wb is None
+    if own_wb:
+        if load_workbook is None:
+            raise ImportError("openpyxl is required; install with: pip install openpyxl")
+        wb = load_workbook(read_only=True, data_only=True, filename=filelike)
     students: List[dict] = []
-    for row_idx, row in enumerate(ws.iter_rows(min_row=2, max_row=ws.max_row, values_only=True), start=2):
-        if not row or len(row) < 3:
-            continue
-        group_num, sex_raw, name = row[0], row[1], row[2]
-        try:
-            group_num = int(group_num) if group_num is not None else 0
-        except (TypeError, ValueError):
-            continue
-        sex = _normalize_sex(str(sex_raw or ""))
-        name = (name or "").strip() or f"Student {row_idx}"
-        if sex not in ("F", "M"):
-            continue
-        students.append({
-            "id": len(students),
-            "name": name,
-            "sex": sex,
-            "group": group_num,
-        })
-    wb.close()
+    try:
+        numbers = _study_group_sheet_numbers(wb)
+        if not numbers:
+            return students
+        ws = wb[f"{STUDY_GROUP_SHEET_PREFIX}{numbers[-1]}"]
+        for row_idx, (group_num, sex_raw, name) in enumerate(
+            ws.iter_rows(min_row=2, max_col=3, values_only=True), start=2
+        ):
+            try:
+                group_num = int(group_num) if group_num is not None else 0
+            except (TypeError, ValueError):
+                continue
+            sex = _normalize_sex(str(sex_raw or ""))
+            name = (name or "").strip() or f"Student {row_idx}"
+            if sex not in ("F", "M"):
+                continue
+            students.append({
+                "id": len(students),
+                "name": name,
+                "sex": sex,
+                "group": group_num,
+            })
+    finally:
+        if own_wb:
+            wb.close()
     return students
 
 
+def _greedy_groups(
+    students: List[dict],
+    G: int,
+    group_size: int,
+    same_sex: bool,
+    prior_together_pairs: Set[Tuple[int, int]],
+) -> dict:
+    """
+    Cheap starting assignment used as a CP-SAT hint: student id -> group index.
+    Each student joins the open group with the fewest prior partners, then the fewest of
+    their own sex, then the fewest members.
+    Mixed: sexes are interleaved across all groups. Same-sex: females fill the first
+    groups and males the rest.
+    Groups are relabelled by first member in input order to match solve()'s symmetry breaking.
+    """
+    partners: dict = {}
+    for (a, b) in prior_together_pairs:
+        partners.setdefault(a, set()).add(b)
+        partners.setdefault(b, set()).add(a)
+    females = [s for s in students if s["sex"] == "F"]
+    males = [s for s in students if s["sex"] == "M"]
+    # Any other sex value is not constrained by solve(); place those students last, anywhere.
+    others = [s for s in students if s["sex"] not in ("F", "M")]
+    if same_sex and G > 1:
+        split = min(ceil(len(females) / group_size), G - 1) if males else G
+        passes = [(females, range(split)), (males, range(split, G)), (others, range(G))]
+    else:
+        interleaved = [s for pair in zip(females, males) for s in pair]
+        interleaved += females[len(males):] + males[len(females):] + others
+        passes = [(interleaved, range(G))]
+    members: List[List[int]] = [[] for _ in range(G)]
+    sex_count: dict = {}
+    greedy = {}
+    for block, candidates in passes:
+        for s in block:
+            sid, sex = s["id"], s["sex"]
+            mine = partners.get(sid, ())
+            open_groups = [g for g in candidates if len(members[g]) < group_size] or list(candidates)
+            g = min(open_groups, key=lambda g: (
+                sum(1 for o in members[g] if o in mine),
+                sex_count.get((g, sex), 0),
+                len(members[g]),
+            ))
+            members[g].append(sid)
+            sex_count[(g, sex)] = sex_count.get((g, sex), 0) + 1
+            greedy[sid] = g
+    relabel: dict = {}
+    for s in students:
+        relabel.setdefault(greedy[s["id"]], len(relabel))
+    return {sid: relabel[g] for sid, g in greedy.items()}
+
+
 def solve(
     group_size: int,
     same_sex: bool,
     students: List[dict],
-    prior_together_pairs: Union[Set[Tuple[str, str]], None] = None,
+    prior_together_pairs: Union[Set[Tuple[int, int]], None] = None,
     time_limit_seconds: float = 30.0,
+    num_workers: Union[int, None] = None,
 ) -> List[List[dict]]:
     """
     Assign students to groups with at most group_size members per group.
     Number of groups G = ceil(n / group_size).
     same_sex=True => each group all F or all M.
     same_sex=False (mixed) => each group must have both sexes (no single-sex groups).
-    prior_together_pairs: set of (name1, name2) that should be avoided in the same group (soft penalty).
+    prior_together_pairs: set of (id1, id2) student ids that should be avoided in the same group
+    (soft penalty); see get_prior_together_pairs.
+    num_workers: parallel CP-SAT search workers, 1..DEFAULT_NUM_WORKERS (default DEFAULT_NUM_WORKERS).
     Returns list of groups; each group is a list of student dicts (same refs as input).
     """
     n = len(students)
@@ -217,74 +288,80 @@ def solve(
 
     # Hard: each student in exactly one group
     for s in students:
-        model.Add(sum(assign[(s["id"], g)] for g in range(G)) == 1)
+        model.AddExactlyOne([assign[(s["id"], g)] for g in range(G)])
+
+    # Symmetry breaking: groups are interchangeable, so number them by their first
+    # member in input order. The i-th student then never needs a group above i.
+    for i, s in enumerate(students[: G - 1]):
+        for g in range(i + 1, G):
+            model.Add(assign[(s["id"], g)] == 0)
 
-    # Hard: each group size <= group_size
+    # Hard: each group size <= group_size (the size_g domain); size_g is reused by the soft size term
+    size_g = []
     for g in range(G):
-        model.Add(
-            sum(assign[(s["id"], g)] for s in students) <= group_size
-        )
+        size_g.append(model.NewIntVar(0, group_size, f"size_g{g}"))
+        model.Add(size_g[g] == cp_model.LinearExpr.Sum([assign[(s["id"], g)] for s in students]))
 
     females = [s for s in students if s["sex"] == "F"]
     males = [s for s in students if s["sex"] == "M"]
+    # Per-group sex counts, shared by the same-sex, mixed and balance blocks below
+    female_sums = [cp_model.LinearExpr.Sum([assign[(s["id"], g)] for s in females]) for g in range(G)]
+    male_sums = [cp_model.LinearExpr.Sum([assign[(s["id"], g)] for s in males]) for g in range(G)]
 
     if same_sex:
         # Same-sex: for each group, either all F or all M
         for g in range(G):
-            female_count = sum(assign[(s["id"], g)] for s in females)
-            male_count = sum(assign[(s["id"], g)] for s in males)
             is_female_only = model.NewBoolVar(f"female_only_g{g}")
-            model.Add(male_count == 0).OnlyEnforceIf(is_female_only)
-            model.Add(female_count == 0).OnlyEnforceIf(is_female_only.Not())
+            model.Add(male_sums[g] == 0).OnlyEnforceIf(is_female_only)
+            model.Add(female_sums[g] == 0).OnlyEnforceIf(is_female_only.Not())
     else:
         # Mixed: avoid single-sex groups — each group must have at least 1 F and 1 M when we have enough of each
         if females and males and len(females) >= G and len(males) >= G:
             for g in range(G):
-                female_count = sum(assign[(s["id"], g)] for s in females)
-                male_count = sum(assign[(s["id"], g)] for s in males)
-                model.Add(female_count >= 1)
-                model.Add(male_count >= 1)
+                model.Add(female_sums[g] >= 1)
+                model.Add(male_sums[g] >= 1)
 
     # Soft: group sizes close to group_size
-    penalties: List[Any] = []
+    # Objective terms as parallel lists, handed to CP-SAT as one weighted sum
+    penalty_vars: List[Any] = []
+    penalty_weights: List[int] = []
     size_weight = 1
     for g in range(G):
-        size_g = model.NewIntVar(0, n, f"size_g{g}")
-        model.Add(size_g == sum(assign[(s["id"], g)] for s in students))
         dev = model.NewIntVar(0, group_size, f"dev_g{g}")
-        model.AddAbsEquality(dev, size_g - group_size)
-        penalties.append(dev * size_weight)
+        model.AddAbsEquality(dev, size_g[g] - group_size)
+        penalty_vars.append(dev)
+        penalty_weights.append(size_weight)
 
     # Soft (mixed only): 50-50 balance per group
     if not same_sex:
         balance_weight = 2
         for g in range(G):
-            female_count = sum(assign[(s["id"], g)] for s in females)
-            male_count = sum(assign[(s["id"], g)] for s in males)
             imbalance = model.NewIntVar(0, group_size, f"imbalance_g{g}")
-            model.AddAbsEquality(imbalance, female_count - male_count)
-            penalties.append(imbalance * balance_weight)
+            model.AddAbsEquality(imbalance, female_sums[g] - male_sums[g])
+            penalty_vars.append(imbalance)
+            penalty_weights.append(balance_weight)
 
     # Soft: avoid putting prior-together pairs in the same group
-    name_to_id = {s["name"].strip(): s["id"] for s in students}
     pair_weight = 10
-    for (name1, name2) in prior_together_pairs:
-        id1 = name_to_id.get(name1)
-        id2 = name_to_id.get(name2)
-        if id1 is None or id2 is None or id1 == id2:
-            continue
+    for (id1, id2) in sorted(prior_together_pairs):
         for g in range(G):
+            # Linear AND: both_in_g is forced to 1 when both are in g. The upper
+            # bounds (both_in_g <= each) are implied since we only minimise it.
             both_in_g = model.NewBoolVar(f"prior_{id1}_{id2}_g{g}")
-            model.AddMultiplicationEquality(both_in_g, [
-                assign[(id1, g)],
-                assign[(id2, g)],
-            ])
-            penalties.append(both_in_g * pair_weight)
+            model.Add(both_in_g >= assign[(id1, g)] + assign[(id2, g)] - 1)
+            penalty_vars.append(both_in_g)
+            penalty_weights.append(pair_weight)
 
-    model.Minimize(sum(penalties))
+    # Warm start: hint a greedy assignment so the solver begins with an upper bound
+    greedy = _greedy_groups(students, G, group_size, same_sex, prior_together_pairs)
+    for (sid, g), var in assign.items():
+        model.AddHint(var, 1 if greedy.get(sid) == g else 0)
+
+    model.Minimize(cp_model.LinearExpr.WeightedSum(penalty_vars, penalty_weights))
 
     solver = cp_model.CpSolver()
     solver.parameters.max_time_in_seconds = time_limit_seconds
+    solver.parameters.num_workers = min(max(num_workers or DEFAULT_NUM_WORKERS, 1), DEFAULT_NUM_WORKERS)
     status = solver.Solve(model)
 
     if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
@@ -296,7 +373,7 @@ def solve(
     groups: List[List[dict]] = [[] for _ in range(G)]
     for s in students:
         for g in range(G):
-            if solver.Value(assign[(s["id"], g)]) == 1:
+            if solver.BooleanValue(assign[(s["id"], g)]):
                 groups[g].append(s)
                 break
     return groups
@@ -316,23 +393,40 @@ def build_txt(groups: List[List[dict]]) -> str:
     return "\n".join(lines).strip() + "\n"
 
 
-def build_csv(
+class _CsvLine:
+    """File-like sink for csv.writer: writerow() returns the formatted line."""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def iter_csv(
     groups: List[List[dict]],
     timestamp: Union[str, datetime, None] = None,
     members_sep: str = ";",
-) -> str:
+) -> Iterator[str]:
     """
-    Build .csv content: header timestamp,members; one row per group.
+    Yield .csv content line by line: header timestamp,members; one row per group.
     timestamp defaults to now (ISO format) if not provided.
     """
     if timestamp is None:
         timestamp = datetime.now(timezone.utc).isoformat()
     elif isinstance(timestamp, datetime):
         timestamp = timestamp.isoformat()
-    out = StringIO()
-    writer = csv.writer(out)
-    writer.writerow(["timestamp", "members"])
+    writer = csv.writer(_CsvLine())
+    yield writer.writerow(["timestamp", "members"])
     for group in groups:
         members = members_sep.join(s["name"] for s in group)
-        writer.writerow([timestamp, members])
-    return out.getvalue()
+        yield writer.writerow([timestamp, members])
+
+
+def build_csv(
+    groups: List[List[dict]],
+    timestamp: Union[str, datetime, None] = None,
+    members_sep: str = ";",
+) -> str:
+    """
+    Build .csv content: header timestamp,members; one row per group.
+    timestamp defaults to now (ISO format) if not provided.
+    """
+    return "".join(iter_csv(groups, timestamp, members_sep))